@@ -7,20 +7,47 @@
 
 import sublime
 import sublime_plugin
-import P4
 import os
 import sys
 import threading
 import subprocess
 import re
 import tempfile
+import concurrent.futures
+import time
+import heapq
+import itertools
+import collections
 from .utilities import \
    getAllViewsForPath, \
    coercePathsToActiveViewIfNeeded, \
    getRevisionQualifiedDepotPath, \
    checkForAndGetSinglePath, \
    ellipsizeIfDirectory, \
-   createRevision
+   splitIntoBatches, \
+   createRevision, \
+   LazyModule
+
+# P4 is a compiled extension that is slow to import, so it is imported on first use (or by the warm-up thread)
+# rather than while Sublime is loading plugins.
+P4 = LazyModule("P4")
+
+MAX_IDLE_CONNECTIONS_PER_KEY = 4
+
+# Commands waiting for a server slot are admitted in this order.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_STATUS = 1
+PRIORITY_PREFETCH = 2
+PRIORITY_BACKGROUND = 3 # long-running work such as depot searches, batch resolves and the startup warm-up
+PRIORITY_NAMES = {
+   PRIORITY_INTERACTIVE: "interactive",
+   PRIORITY_STATUS: "status",
+   PRIORITY_PREFETCH: "prefetch",
+   PRIORITY_BACKGROUND: "background"
+}
+
+# Commands that don't modify anything, so identical concurrent calls can share one result.
+READ_ONLY_COMMANDS = frozenset(["changes", "describe", "diff2", "dirs", "filelog", "files", "fstat", "info", "opened", "print"])
 
 NEW_CHANGELIST_NAME = "new"
 NEW_CHANGELIST_DESCRIPTION = "Creates a new changelist."
@@ -31,6 +58,8 @@ HAVE_REVISION_NAME = "have"
 HAVE_REVISION_DESCRIPTION = "The currently synced revision."
 HEAD_REVISION_NAME = "head"
 HEAD_REVISION_DESCRIPTION = "The most recently checked-in revision."
+MORE_REVISIONS_NAME = "more..."
+MORE_REVISIONS_DESCRIPTION = "Loads older revisions."
 
 FILE_CHECKED_OUT_SETTING_KEY = "subforce_file_checked_out"
 FILE_NOT_IN_DEPOT_SETTING_KEY = "subforce_file_not_in_depot"
@@ -43,6 +72,28 @@ CONNECTION_INFO_PORT_SETTINGS_KEY = 'connection_info_port'
 CONNECTION_INFO_USER_SETTINGS_KEY = 'connection_info_user'
 CONNECTION_INFO_CLIENT_SETTINGS_KEY = 'connection_info_client'
 DISABLE_AUTO_CHECKOUT_SETTINGS_KEY = 'disable_auto_checkout'
+RESOLVE_BATCH_SIZE_SETTINGS_KEY = 'resolve_batch_size'
+RESOLVE_MAX_CONCURRENT_BATCHES_SETTINGS_KEY = 'resolve_max_concurrent_batches'
+GREP_PAGE_SIZE_SETTINGS_KEY = 'grep_page_size'
+GREP_MAX_RESULTS_SETTINGS_KEY = 'grep_max_results'
+CHANGELIST_CONTENTS_DEBOUNCE_SETTINGS_KEY = 'changelist_contents_debounce'
+REVISION_DESCRIPTION_DEBOUNCE_SETTINGS_KEY = 'revision_description_debounce'
+MAX_CONCURRENT_SERVER_COMMANDS_SETTINGS_KEY = 'max_concurrent_server_commands'
+REVISION_PAGE_SIZE_SETTINGS_KEY = 'revision_page_size'
+DEPOT_REVISION_CACHE_SIZE_SETTINGS_KEY = 'depot_revision_cache_size'
+
+CONFLICT_PANE_STATUS_KEY = "subforce_conflict_pane"
+GREP_RESULTS_SETTING_KEY = "subforce_grep_results"
+DIFF2_VIEW_SETTING_KEY = "subforce_diff2_view"
+DIFF2_FILE_SETTING_KEY = "subforce_diff2_file"
+DIFF2_REVISIONS_SETTING_KEY = "subforce_diff2_revisions"
+
+DIFF_SYNTAX = "Packages/Diff/Diff.sublime-syntax"
+
+GREP_RESULT_RE = r'^(//.+?)#(\d+):(\d+): '
+GREP_FLUSH_INTERVAL = 0.2 # seconds
+# The server's maxresults, maxscanrows and grep revision limits (see 'p4 help maxresults' and 'p4 help grep').
+SERVER_LIMIT_ERROR_RE = r"Request too large|Too many rows scanned|maxresults|maxscanrows|revision limit exceeded"
 
 class SettingsWrapper(object):
    def __init__(self):
@@ -57,35 +108,254 @@ class SettingsWrapper(object):
          raise P4.P4Exception("Subforce: You must set the {} setting!".format(name))
       return setting
 
+class ConnectionPool(object):
+   '''
+   Keeps connected P4 instances around between commands, so that each command doesn't pay for a new connection.
+   A connection is only handed to one PerforceWrapper at a time, since P4 connections aren't thread-safe.
+   Idle connections are kept for as long as they stay connected; a connection the server has since dropped
+   is detected (and replaced) by PerforceWrapper when its first command fails.
+   '''
+   _lock = threading.Lock()
+   _idleConnections = {} # connection key -> list of P4 instances
+
+   @classmethod
+   def acquire(self, key):
+      with self._lock:
+         idleConnections = self._idleConnections.get(key, [])
+         while idleConnections:
+            p4 = idleConnections.pop()
+            if p4.connected():
+               return p4
+            self._disconnect(p4)
+      return None
+
+   @classmethod
+   def release(self, key, p4):
+      if not p4.connected():
+         return
+
+      with self._lock:
+         idleConnections = self._idleConnections.setdefault(key, [])
+         if len(idleConnections) < MAX_IDLE_CONNECTIONS_PER_KEY:
+            idleConnections.append(p4)
+            return
+
+      self._disconnect(p4)
+
+   @classmethod
+   def clear(self):
+      with self._lock:
+         for idleConnections in self._idleConnections.values():
+            for p4 in idleConnections:
+               self._disconnect(p4)
+         self._idleConnections.clear()
+
+   @classmethod
+   def _disconnect(self, p4):
+      try:
+         if p4.connected():
+            p4.disconnect()
+      except P4.P4Exception:
+         print("Subforce: failed to disconnect!")
+
+class InFlightCommand(object):
+   def __init__(self):
+      self._doneEvent = threading.Event()
+      self._result = None
+      self._exception = None
+
+   def finish(self, result=None, exception=None):
+      self._result = result
+      self._exception = exception
+      self._doneEvent.set()
+
+   def wait(self):
+      self._doneEvent.wait()
+      if self._exception:
+         raise self._exception
+      return list(self._result)
+
+class CommandScheduler(object):
+   '''
+   Every Perforce command runs through here, so that only a limited number of them hit the server at once.
+   Commands waiting for a slot are admitted by priority (interactive, then status, then prefetch, then background),
+   and an identical read-only command that is already in flight is waited on rather than sent to the server again.
+   Prefetch and background commands never take the last slot, since a running command can't be interrupted and
+   interactive and status commands are often waited on by the UI thread.
+   Commands still execute on the caller's thread and connection; the scheduler only decides when.
+   '''
+   _condition = threading.Condition()
+   _waitingCommands = [] # heap of (priority, sequence number)
+   _sequenceNumbers = itertools.count()
+   _runningCount = 0
+   _inFlightReadCommands = {} # (connection key, command, arguments) -> InFlightCommand
+   _metrics = {'executed': 0, 'deduplicated': 0, 'peakQueueDepth': 0, 'peakRunning': 0}
+
+   @classmethod
+   def run(self, priority, connectionKey, command, args, kwargs, execute):
+      inFlightCommand = None
+
+      if command in READ_ONLY_COMMANDS and not kwargs:
+         readCommandKey = (connectionKey, command, repr(args))
+         with self._condition:
+            existingInFlightCommand = self._inFlightReadCommands.get(readCommandKey)
+            if existingInFlightCommand:
+               self._metrics['deduplicated'] += 1
+            else:
+               inFlightCommand = self._inFlightReadCommands[readCommandKey] = InFlightCommand()
+
+         if existingInFlightCommand:
+            return existingInFlightCommand.wait()
+
+      try:
+         self._acquireSlot(priority)
+         try:
+            result = execute()
+         finally:
+            self._releaseSlot()
+      except Exception as exception:
+         if inFlightCommand:
+            self._finishReadCommand(readCommandKey, inFlightCommand, exception=exception)
+         raise
+
+      if inFlightCommand:
+         self._finishReadCommand(readCommandKey, inFlightCommand, result=result)
+
+      return result
+
+   @classmethod
+   def getMetrics(self):
+      with self._condition:
+         metrics = dict(self._metrics)
+         metrics['running'] = self._runningCount
+         metrics['queueDepth'] = len(self._waitingCommands)
+         for priority, priorityName in PRIORITY_NAMES.items():
+            metrics['queueDepth.{}'.format(priorityName)] = sum(1 for waitingCommand in self._waitingCommands if waitingCommand[0] == priority)
+         return metrics
+
+   @classmethod
+   def _acquireSlot(self, priority):
+      # At least two slots, so that the one reserved for interactive and status commands leaves room for the rest.
+      maxConcurrentCommands = max(2, SettingsWrapper().get(MAX_CONCURRENT_SERVER_COMMANDS_SETTINGS_KEY, 4))
+      if priority > PRIORITY_STATUS:
+         maxConcurrentCommands -= 1
+
+      with self._condition:
+         waitingCommand = (priority, next(self._sequenceNumbers))
+         heapq.heappush(self._waitingCommands, waitingCommand)
+         self._metrics['peakQueueDepth'] = max(self._metrics['peakQueueDepth'], len(self._waitingCommands))
+
+         while self._runningCount >= maxConcurrentCommands or self._waitingCommands[0] != waitingCommand:
+            self._condition.wait()
+
+         heapq.heappop(self._waitingCommands)
+         self._runningCount += 1
+         self._metrics['executed'] += 1
+         self._metrics['peakRunning'] = max(self._metrics['peakRunning'], self._runningCount)
+
+         # The next command in line may be able to run as well.
+         self._condition.notify_all()
+
+   @classmethod
+   def _releaseSlot(self):
+      with self._condition:
+         self._runningCount -= 1
+         self._condition.notify_all()
+
+   @classmethod
+   def _finishReadCommand(self, readCommandKey, inFlightCommand, result=None, exception=None):
+      with self._condition:
+         self._inFlightReadCommands.pop(readCommandKey, None)
+      inFlightCommand.finish(result, exception)
+
 class PerforceWrapper(object):
-   def __init__(self, squelchErrorAndWarninMessages=False):
-      self._p4 = P4.P4()
+   def __init__(self, squelchErrorAndWarninMessages=False, priority=PRIORITY_INTERACTIVE):
       self._settings = SettingsWrapper()
 
       currentWorkingDirectorySetting = self._settings.get(CURRENT_WORKING_DIRECTORY_SETTING_KEY, None)
       projectPath = sublime.active_window().extract_variables()['folder']
-      self._p4.cwd = currentWorkingDirectorySetting if currentWorkingDirectorySetting else projectPath
+      self._cwd = currentWorkingDirectorySetting if currentWorkingDirectorySetting else projectPath
 
-      self._p4.exception_level = 1 # Only errors are raised as exceptions. Warnings are accessed through p4.warnings
-
-      self._p4.api_level = 79 # Lock to 2015.2 format
+      self._p4 = self._createP4()
 
       self._contextManagerEnterLevel = 0
       self._squelchErrorAndWarninMessages = squelchErrorAndWarninMessages
 
+      self._connectionKey = None
+      self._reuseConnection = True
+      self._mayBeDroppedConnection = False
+      self._keepAlive = None
+      self._ranCommand = False
+      self._priority = priority
+
+   def _createP4(self):
+      p4 = P4.P4()
+      p4.cwd = self._cwd
+
+      p4.exception_level = 1 # Only errors are raised as exceptions. Warnings are accessed through p4.warnings
+
+      p4.api_level = 79 # Lock to 2015.2 format
+
+      return p4
+
    def __getattr__(self, name):
       attribute = getattr(self._p4, name)
+      if name.startswith("run_"):
+         return self._scheduleCommand(name[len("run_"):], attribute)
       return attribute
 
+   def _scheduleCommand(self, command, runMethod):
+      def scheduledRunMethod(*args, **kwargs):
+         def execute():
+            self._ranCommand = True
+            try:
+               return runMethod(*args, **kwargs)
+            except P4.P4Exception:
+               if not self._mayBeDroppedConnection or self._p4.connected():
+                  raise
+
+               # The server dropped this pooled connection while it sat idle; reconnect and retry once.
+               print("Subforce: pooled connection was dropped; reconnecting")
+               self._reconnect()
+               return getattr(self._p4, "run_" + command)(*args, **kwargs)
+            finally:
+               self._mayBeDroppedConnection = False
+
+         return CommandScheduler.run(self._priority, self._connectionKey, command, args, kwargs, execute)
+
+      return scheduledRunMethod
+
+   def _reconnect(self):
+      self._p4 = self._createP4()
+      self._applyConnectionInfo()
+      if self._keepAlive:
+         self._p4.set_break(self._keepAlive)
+      self._p4.connect()
+
+   def set_break(self, keepAlive):
+      # Remembered so that it survives a reconnect.
+      self._keepAlive = keepAlive
+      self._p4.set_break(keepAlive)
+
+   def _applyConnectionInfo(self):
+      if self._settings.get(USE_CONNECTION_INFO_SETTINGS_KEY, False):
+         self._p4.port = self._settings.getOrThrow(CONNECTION_INFO_PORT_SETTINGS_KEY)
+         self._p4.user = self._settings.getOrThrow(CONNECTION_INFO_USER_SETTINGS_KEY)
+         self._p4.client = self._settings.getOrThrow(CONNECTION_INFO_CLIENT_SETTINGS_KEY)
+
    def __enter__(self):
       if self._contextManagerEnterLevel == 0:
          try:
-            if self._settings.get(USE_CONNECTION_INFO_SETTINGS_KEY, False):
-               self._p4.port = self._settings.getOrThrow(CONNECTION_INFO_PORT_SETTINGS_KEY)
-               self._p4.user = self._settings.getOrThrow(CONNECTION_INFO_USER_SETTINGS_KEY)
-               self._p4.client = self._settings.getOrThrow(CONNECTION_INFO_CLIENT_SETTINGS_KEY)
+            self._applyConnectionInfo()
 
-            self._p4.connect()
+            self._connectionKey = (self._p4.cwd, self._p4.port, self._p4.user, self._p4.client)
+            pooledConnection = ConnectionPool.acquire(self._connectionKey) if self._reuseConnection else None
+
+            if pooledConnection:
+               self._p4 = pooledConnection
+               self._mayBeDroppedConnection = True
+            else:
+               self._p4.connect()
 
          except:
             if self.__exit__(*sys.exc_info()):
@@ -102,10 +372,19 @@ class PerforceWrapper(object):
       if self._contextManagerEnterLevel == 1:
          self.handleWarnings()
 
-         try:
-            self._p4.disconnect()
-         except P4.P4Exception:
-            print("Subforce: failed to disconnect!")
+         if self._reuseConnection:
+            ConnectionPool.release(self._connectionKey, self._p4)
+
+            # The released connection now belongs to the pool, so the next __enter__ must not touch it.
+            self._p4 = self._createP4()
+            self._ranCommand = False
+            self._mayBeDroppedConnection = False
+            self._keepAlive = None
+         else:
+            try:
+               self._p4.disconnect()
+            except P4.P4Exception:
+               print("Subforce: failed to disconnect!")
 
          noErrors = self.handleErrors(type, value, traceback)
 
@@ -114,13 +393,15 @@ class PerforceWrapper(object):
 
    def login(self, password):
       self._p4.password = password
+      self._reuseConnection = False # pooled connections don't carry the password
       with self as p4:
          p4.run_login()
          print("Subforce: sucessfully logged in!")
 
    def handleWarnings(self):
       displayWarningsSetting = self._settings.get(DISPLAY_WARNINGS_SETTING_KEY, True)
-      if not self._squelchErrorAndWarninMessages and displayWarningsSetting:
+      # A pooled connection still holds the warnings of its last command, which may not be ours.
+      if self._ranCommand and not self._squelchErrorAndWarninMessages and displayWarningsSetting:
          for warning in self._p4.warnings:
             sublime.message_dialog(str(warning))
 
@@ -139,10 +420,23 @@ class PerforceWrapper(object):
 
       return noErrors
 
+def warmUpConnection():
+   try:
+      with PerforceWrapper(squelchErrorAndWarninMessages=True, priority=PRIORITY_BACKGROUND) as p4:
+         p4.run_login("-s") # validates the login ticket
+         print("Subforce: connection warmed up!")
+   except Exception as exception:
+      print("Subforce: connection warm-up failed ({})".format(exception))
+
 def plugin_loaded():
+   # Importing P4, resolving the configuration and connecting are done off the main thread,
+   # so that they neither slow down editor startup nor the first Subforce command.
+   threading.Thread(target=warmUpConnection, daemon=True).start()
    print("Subforce: plugin loaded!")
 
 def plugin_unloaded():
+   DepotRevisionCache.clear()
+   ConnectionPool.clear()
    print("Subforce: plugin unloaded!")
 
 class SubforceDisplayDescriptionCommand(sublime_plugin.TextCommand):
@@ -155,6 +449,15 @@ class SubforceDisplayDescriptionCommand(sublime_plugin.TextCommand):
 
       self.view.set_read_only(True)
 
+class SubforceAppendTextCommand(sublime_plugin.TextCommand):
+   def run(self, edit, text = ""):
+      # Enable editing momentarily to append text
+      self.view.set_read_only(False)
+
+      self.view.insert(edit, self.view.size(), text)
+
+      self.view.set_read_only(True)
+
 class DescriptionOutputPanel(object):
    _outputPanelName = 'description_output_panel'
    _qualifiedOutputPanelName = 'output.description_output_panel'
@@ -214,7 +517,14 @@ class ChangelistManager(object):
 
          changelists.extend(p4.run_changes("-c", p4.client, "-s", "pending", "-l"))
 
+         changelistContents = {} # changelist number -> formatted opened and shelved files, fetched lazily
+         highlightedIndex = None
+         debounceDelay = SettingsWrapper().get(CHANGELIST_CONTENTS_DEBOUNCE_SETTINGS_KEY, 250)
+
          def onDone(selectedIndex):
+            nonlocal highlightedIndex
+            highlightedIndex = None
+
             self._changelistDescriptionOutputPanel.hide()
             selectedChangelistNumber = changelists[selectedIndex]['change'] if selectedIndex >= 0 else None
 
@@ -225,8 +535,35 @@ class ChangelistManager(object):
                onDoneCallback(selectedChangelistNumber)
             SubforceStatusUpdatingEventListener.updateStatus(self._window.active_view())
 
+         def showChangelist(index):
+            changelist = changelists[index]
+            if changelist['change'] == NEW_CHANGELIST_NAME:
+               self._changelistDescriptionOutputPanel.show(changelist['desc'])
+            else:
+               self._changelistDescriptionOutputPanel.show(
+                  "{}\n\n{}".format(changelist['desc'], changelistContents.get(changelist['change'], "Loading files..."))
+               )
+
+         def fetchContentsIfStillHighlighted(index):
+            # Only the row the user settles on is fetched, so scrolling through the list doesn't flood the server.
+            changelistNumber = changelists[index]['change']
+            if index != highlightedIndex or changelistNumber in changelistContents:
+               return
+
+            changelistContents[changelistNumber] = self._getChangelistContents(changelistNumber)
+
+            if index == highlightedIndex:
+               sublime.set_timeout(lambda: showChangelist(index), 0)
+
          def onHighlighted(selectedIndex):
-            self._changelistDescriptionOutputPanel.show(changelists[selectedIndex]['desc'])
+            nonlocal highlightedIndex
+            highlightedIndex = selectedIndex
+
+            showChangelist(selectedIndex)
+
+            changelistNumber = changelists[selectedIndex]['change']
+            if changelistNumber != NEW_CHANGELIST_NAME and changelistNumber not in changelistContents:
+               sublime.set_timeout_async(lambda: fetchContentsIfStillHighlighted(selectedIndex), debounceDelay)
 
          changelistItems = [[changelist['change'], changelist['desc'][:250]] for changelist in changelists]
 
@@ -238,6 +575,29 @@ class ChangelistManager(object):
             onHighlighted
          )
 
+   def _getChangelistContents(self, changelistNumber):
+      formatFile = lambda depotFile, revision, action: "\t{} {}".format(getRevisionQualifiedDepotPath(depotFile, revision), action)
+
+      # The result is cached by the caller either way, so a failing changelist isn't fetched again on every highlight.
+      try:
+         with PerforceWrapper(squelchErrorAndWarninMessages=True, priority=PRIORITY_PREFETCH) as p4:
+            openedFiles = [formatFile(opened['depotFile'], opened['rev'], opened['action']) for opened in p4.run_opened("-c", changelistNumber)]
+
+            shelvedFiles = []
+            if changelistNumber != DEFAULT_CHANGELIST_NAME:
+               describe = p4.run_describe("-s", "-S", changelistNumber)[0]
+               shelvedFiles = [
+                  formatFile(depotFile, revision, action)
+                  for depotFile, revision, action in zip(describe.get('depotFile', []), describe.get('rev', []), describe.get('action', []))
+               ]
+
+            return "Opened files:\n{}\n\nShelved files:\n{}".format(
+               "\n".join(openedFiles) if openedFiles else "\t(none)",
+               "\n".join(shelvedFiles) if shelvedFiles else "\t(none)"
+            )
+      except P4.P4Exception as exception:
+         return "Files unavailable: {}".format(str(exception).strip())
+
    def createChangelist(self):
       return self.editChangelist(None)
 
@@ -359,7 +719,7 @@ class SubforceStatusUpdatingEventListener(sublime_plugin.EventListener):
    def updateStatus(self, view):
       settings = view.settings()
       try:
-         with PerforceWrapper(squelchErrorAndWarninMessages=True) as p4:
+         with PerforceWrapper(squelchErrorAndWarninMessages=True, priority=PRIORITY_STATUS) as p4:
             stat = p4.run_fstat(view.file_name())  # check if file is in depot
             if stat:
                stat = stat[0]
@@ -618,6 +978,12 @@ class SubforceViewTimelapseCommand(sublime_plugin.WindowCommand):
       for path in paths:
          executeP4VCCommand("timelapseview", path)
 
+class SubforceShowSchedulerMetricsCommand(sublime_plugin.WindowCommand):
+   def run(self):
+      metrics = CommandScheduler.getMetrics()
+      print("Subforce: scheduler metrics {}".format(metrics))
+      sublime.message_dialog("\n".join("{}: {}".format(name, value) for name, value in sorted(metrics.items())))
+
 class SubforceSubmitChangelistCommand(sublime_plugin.WindowCommand):
    def run(self):
       perforceWrapper = PerforceWrapper()
@@ -656,9 +1022,7 @@ class RevisionManager:
 
    def diffDepotRevisions(self, revision1, revision2, file):
       with self._perforceWrapper as p4:
-         (revision1, revision2) = sorted([revision1, revision2]) # ensures the most recent revision is on the right
-
-         depotFilePath = p4.run_fstat(file)[0]['depotFile']
+         depotFilePath, (revision1, revision2) = self._getDepotFileAndOrderedRevisionNumbers(p4, file, revision1, revision2)
 
          temporaryDepotFilePath1 = self._createTemporaryDepotFile(depotFilePath, revision1)
          temporaryDepotFilePath2 = self._createTemporaryDepotFile(depotFilePath, revision2)
@@ -669,29 +1033,110 @@ class RevisionManager:
             getRevisionQualifiedDepotPath(depotFilePath, revision2)
          )
 
+   def diff2DepotRevisions(self, revision1, revision2, file):
+      with self._perforceWrapper as p4:
+         depotFilePath, (revision1, revision2) = self._getDepotFileAndOrderedRevisionNumbers(p4, file, revision1, revision2)
+
+         leftDepotFilePath = getRevisionQualifiedDepotPath(depotFilePath, revision1)
+         rightDepotFilePath = getRevisionQualifiedDepotPath(depotFilePath, revision2)
+
+         # The diff is computed on the server, so neither revision has to be downloaded.
+         diffText = "".join(output for output in p4.run_diff2("-du", leftDepotFilePath, rightDepotFilePath) if isinstance(output, str))
+
+         diffView = self._window.new_file()
+         diffView.set_name("{} vs #{}".format(leftDepotFilePath, revision2))
+         diffView.set_scratch(True)
+         diffView.set_syntax_file(DIFF_SYNTAX)
+
+         diffViewSettings = diffView.settings()
+         diffViewSettings.set(DIFF2_VIEW_SETTING_KEY, True)
+         diffViewSettings.set(DIFF2_FILE_SETTING_KEY, file)
+         diffViewSettings.set(DIFF2_REVISIONS_SETTING_KEY, [revision1, revision2])
+
+         diffView.run_command(
+            "subforce_append_text",
+            {
+               "text": "--- {}\n+++ {}\n{}".format(leftDepotFilePath, rightDepotFilePath, diffText or "(no differences)\n")
+            }
+         )
+
    def showHaveHeadRevisions(self, onDoneCallback):
       revisions = [{'revision': HAVE_REVISION_NAME, 'desc': HAVE_REVISION_DESCRIPTION}, {'revision': HEAD_REVISION_NAME, 'desc': HEAD_REVISION_DESCRIPTION}]
       self._showRevisions(revisions, onDoneCallback)
 
    def showHaveHeadAndFileRevisions(self, file, onDoneCallback):
-      with self._perforceWrapper as p4:
-         revisions = [createRevision(HAVE_REVISION_NAME, HAVE_REVISION_DESCRIPTION), createRevision(HEAD_REVISION_NAME, HEAD_REVISION_DESCRIPTION)]
-         revisions.extend(
-            [
-               createRevision(str(revision.rev), revision.desc)
-               for revision in p4.run_filelog("-l", file)[0].revisions
+      pageSize = SettingsWrapper().get(REVISION_PAGE_SIZE_SETTINGS_KEY, 100)
+      oldestLoadedRevision = None
+
+      # Loads the next page of older revisions with their short descriptions, and whether there are any more to load.
+      def loadRevisionPage():
+         nonlocal oldestLoadedRevision
+         with self._perforceWrapper as p4:
+            fileSpec = file if oldestLoadedRevision is None else "{}#1,#{}".format(file, oldestLoadedRevision - 1)
+            revisionPage = [
+               createRevision(str(revision.rev), revision.desc, revision.change)
+               for revision in p4.run_filelog("-m", str(pageSize), "-s", fileSpec)[0].revisions
             ]
-         )
-         self._showRevisions(revisions, onDoneCallback)
+
+            if revisionPage:
+               oldestLoadedRevision = int(revisionPage[-1]['revision'])
+
+            return revisionPage, len(revisionPage) == pageSize and oldestLoadedRevision > 1
+
+      revisions = [createRevision(HAVE_REVISION_NAME, HAVE_REVISION_DESCRIPTION), createRevision(HEAD_REVISION_NAME, HEAD_REVISION_DESCRIPTION)]
+      revisionPage, hasMoreRevisions = loadRevisionPage()
+      revisions.extend(revisionPage)
+
+      self._showRevisions(revisions, onDoneCallback, loadRevisionPage if hasMoreRevisions else None)
 
    def getRevision(self, revision, file):
       with self._perforceWrapper as p4:
          depotFilePath = p4.run_fstat(file)[0]['depotFile']
          p4.run_sync(getRevisionQualifiedDepotPath(depotFilePath, revision))
 
-   def _showRevisions(self, revisions, onDoneCallback):
+   def openDepotRevision(self, depotFilePath, revision, lineNumber=0):
+      def target():
+         temporaryDepotFilePath = self._createTemporaryDepotFile(depotFilePath, revision)
+         if not temporaryDepotFilePath:
+            return
+
+         def openFile():
+            view = self._window.open_file("{}:{}".format(temporaryDepotFilePath, lineNumber), sublime.ENCODED_POSITION)
+            view.set_read_only(True)
+
+         sublime.set_timeout(openFile, 0)
+
+      threading.Thread(target=target).start()
+
+   def _showRevisions(self, revisions, onDoneCallback, loadRevisionPage=None):
       self._callbackDepth += 1
+      highlightedIndex = None
+      debounceDelay = SettingsWrapper().get(REVISION_DESCRIPTION_DEBOUNCE_SETTINGS_KEY, 250)
+
+      def needsFullDescription(revision):
+         return revision.get('change') and not revision.get('descLoaded')
+
+      def hasMoreRevisions():
+         return loadRevisionPage is not None
+
       def onDone(selectedIndex):
+         nonlocal highlightedIndex, loadRevisionPage
+         highlightedIndex = None
+
+         if hasMoreRevisions() and selectedIndex == len(revisions):
+            try:
+               revisionPage, moreRevisionsRemain = loadRevisionPage()
+            except P4.P4Exception: # already reported by PerforceWrapper; close the picker as if cancelled
+               selectedIndex = -1
+            else:
+               firstNewIndex = len(revisions)
+               revisions.extend(revisionPage)
+               if not moreRevisionsRemain:
+                  loadRevisionPage = None
+
+               sublime.set_timeout(lambda: showQuickPanel(firstNewIndex), 0)
+               return
+
          selectedRevision = revisions[selectedIndex]['revision'] if selectedIndex >= 0 else None
 
          if onDoneCallback and selectedRevision:
@@ -701,18 +1146,67 @@ class RevisionManager:
             self._revisionDescriptionOutputPanel.hide()
          self._callbackDepth -= 1
 
+      def fetchDescriptionIfStillHighlighted(index):
+         # Full descriptions are only fetched for the revision the user settles on.
+         revision = revisions[index]
+         if index != highlightedIndex or not needsFullDescription(revision):
+            return
+
+         try:
+            with PerforceWrapper(squelchErrorAndWarninMessages=True, priority=PRIORITY_PREFETCH) as p4:
+               revision['desc'] = p4.run_describe("-s", revision['change'])[0]['desc']
+         except P4.P4Exception as exception:
+            print("Subforce: failed to fetch the description of change {} ({})".format(revision['change'], str(exception).strip()))
+
+         # Even on failure, so that the short description stays and isn't re-fetched on every highlight.
+         revision['descLoaded'] = True
+
+         if index == highlightedIndex:
+            sublime.set_timeout(lambda: self._revisionDescriptionOutputPanel.show(revision['desc']), 0)
+
       def onHighlighted(selectedIndex):
+         nonlocal highlightedIndex
+         highlightedIndex = selectedIndex
+
+         if selectedIndex == len(revisions):
+            self._revisionDescriptionOutputPanel.show(MORE_REVISIONS_DESCRIPTION)
+            return
+
          self._revisionDescriptionOutputPanel.show(revisions[selectedIndex]['desc'])
 
-      revisionItems = [[revision['revision'], revision['desc'][:250]] for revision in revisions]
+         if needsFullDescription(revisions[selectedIndex]):
+            sublime.set_timeout_async(lambda: fetchDescriptionIfStillHighlighted(selectedIndex), debounceDelay)
 
-      self._window.show_quick_panel(
-         revisionItems,
-         onDone,
-         sublime.KEEP_OPEN_ON_FOCUS_LOST,
-         0,
-         onHighlighted
-      )
+      def showQuickPanel(selectedIndex):
+         revisionItems = [[revision['revision'], revision['desc'][:250]] for revision in revisions]
+         if hasMoreRevisions():
+            revisionItems.append([MORE_REVISIONS_NAME, MORE_REVISIONS_DESCRIPTION])
+
+         self._window.show_quick_panel(
+            revisionItems,
+            onDone,
+            sublime.KEEP_OPEN_ON_FOCUS_LOST,
+            selectedIndex,
+            onHighlighted
+         )
+
+      showQuickPanel(0)
+
+   def _getDepotFileAndOrderedRevisionNumbers(self, p4, file, revision1, revision2):
+      stat = p4.run_fstat(file)[0]
+
+      def getRevisionNumber(revision):
+         if revision == HAVE_REVISION_NAME:
+            return int(stat.get('haveRev', 0))
+         elif revision == HEAD_REVISION_NAME:
+            return int(stat['headRev'])
+         else:
+            return int(revision)
+
+      # have and head are pinned to the revisions they name right now, so that a later sync or submit doesn't change
+      # what a diff refers to (and numbered revisions can be reused from the DepotRevisionCache).
+      # Revisions are compared numerically (so #9 comes before #10), which puts the most recent revision on the right.
+      return stat['depotFile'], [str(revisionNumber) for revisionNumber in sorted([getRevisionNumber(revision1), getRevisionNumber(revision2)])]
 
    def _startP4MergeThread(self, leftFile, rightFile, leftFileAlias, rightFileAlias):
       def target():
@@ -728,15 +1222,445 @@ class RevisionManager:
 
    def _createTemporaryDepotFile(self, file, revision):
       with self._perforceWrapper as p4:
+         return DepotRevisionCache.getTemporaryFile(p4, file, revision)
 
-         # @TODO: At some point in time, we may want to create temporary files with the same naming convention as p4v.
-         with tempfile.NamedTemporaryFile(prefix="subforce_", delete=False) as temporaryFile:
-            depotFilePath = getRevisionQualifiedDepotPath(file, revision)
-            depotFileText = p4.run_print(depotFilePath)[1]
-            temporaryFile.write(bytes(depotFileText, 'UTF-8'))
-            return temporaryFile.name
+class DepotRevisionCache(object):
+   '''
+   Stores depot revisions in temporary files, keyed by their revision-qualified depot path.
+   Only numbered revisions are reused, since the have and head revisions can change between calls.
+   The least recently used revisions are deleted once the cache grows past its size limit.
+   '''
+   _lock = threading.Lock()
+   _temporaryFilePaths = collections.OrderedDict() # least recently used first
+
+   @classmethod
+   def getTemporaryFile(self, p4, file, revision):
+      depotFilePath = getRevisionQualifiedDepotPath(file, revision)
+      isCacheable = str(revision).isdigit()
+
+      if isCacheable:
+         with self._lock:
+            temporaryFilePath = self._temporaryFilePaths.get(depotFilePath)
+            if temporaryFilePath:
+               self._temporaryFilePaths.move_to_end(depotFilePath)
+         if temporaryFilePath and os.path.exists(temporaryFilePath):
+            return temporaryFilePath
+
+      # Keep the file name and extension so that the temporary file is recognizable and gets the right syntax.
+      fileName, fileExtension = os.path.splitext(os.path.basename(file))
+      with tempfile.NamedTemporaryFile(
+            prefix="subforce_{}_{}_".format(fileName, revision),
+            suffix=fileExtension,
+            delete=False
+         ) as temporaryFile:
+         depotFileText = p4.run_print(depotFilePath)[1]
+         temporaryFile.write(bytes(depotFileText, 'UTF-8'))
+
+      if isCacheable:
+         cacheSize = max(1, SettingsWrapper().get(DEPOT_REVISION_CACHE_SIZE_SETTINGS_KEY, 100))
+         evictedFilePaths = []
+
+         with self._lock:
+            existingFilePath = self._temporaryFilePaths.get(depotFilePath)
+            if existingFilePath and existingFilePath != temporaryFile.name and os.path.exists(existingFilePath):
+               # Another thread printed the same revision in the meantime; keep its copy.
+               evictedFilePaths.append(temporaryFile.name)
+            else:
+               self._temporaryFilePaths[depotFilePath] = temporaryFile.name
+               existingFilePath = temporaryFile.name
+            self._temporaryFilePaths.move_to_end(depotFilePath)
+
+            while len(self._temporaryFilePaths) > cacheSize:
+               evictedFilePaths.append(self._temporaryFilePaths.popitem(last=False)[1])
 
+         self._removeFiles(evictedFilePaths)
+         return existingFilePath
 
+      return temporaryFile.name
+
+   @classmethod
+   def clear(self):
+      with self._lock:
+         temporaryFilePaths = list(self._temporaryFilePaths.values())
+         self._temporaryFilePaths.clear()
+
+      self._removeFiles(temporaryFilePaths)
+
+   @classmethod
+   def _removeFiles(self, temporaryFilePaths):
+      for temporaryFilePath in temporaryFilePaths:
+         try:
+            os.remove(temporaryFilePath)
+         except OSError:
+            pass
+
+class ResolveManager(object):
+   '''
+   Auto-resolves pending files in concurrent batches and presents the files that still conflict.
+   Each batch runs on its own connection, since a P4 connection must not be shared across threads.
+   '''
+   def __init__(self, window):
+      self._window = window
+      self._settings = SettingsWrapper()
+
+   def autoResolve(self, paths):
+      # This can take minutes, so it gets its own thread rather than tying up Sublime's shared async thread.
+      threading.Thread(target=lambda: self._autoResolve(paths)).start()
+
+   def _autoResolve(self, paths):
+      try:
+         pendingFiles = self._getPendingFiles(paths)
+      except P4.P4Exception: # already reported by PerforceWrapper
+         return
+
+      if not pendingFiles:
+         return
+
+      batchSize = self._settings.get(RESOLVE_BATCH_SIZE_SETTINGS_KEY, 50)
+      maxConcurrentBatches = self._settings.get(RESOLVE_MAX_CONCURRENT_BATCHES_SETTINGS_KEY, 4)
+
+      print("Subforce: auto-resolving {} file(s)".format(len(pendingFiles)))
+
+      batches = splitIntoBatches(pendingFiles, batchSize)
+
+      conflicts = []
+      failedBatches = []
+      with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, maxConcurrentBatches)) as executor:
+         for batch, (batchConflicts, error) in zip(batches, executor.map(self._resolveBatch, batches)):
+            conflicts.extend(batchConflicts)
+            if error:
+               failedBatches.append((batch, error))
+
+      sublime.set_timeout(lambda: self._reportConflicts(len(pendingFiles), conflicts, failedBatches), 0)
+
+   def _getPendingFiles(self, paths):
+      with PerforceWrapper(priority=PRIORITY_BACKGROUND) as p4:
+         pendingFiles = []
+         for resolve in p4.run_resolve("-n", paths):
+            # A file can have several pending resolves (content, filetype, etc.)
+            if 'clientFile' in resolve and resolve['clientFile'] not in pendingFiles:
+               pendingFiles.append(resolve['clientFile'])
+         return pendingFiles
+
+   def _resolveBatch(self, batch):
+      '''
+      Returns the batch's remaining conflicts and, if the batch failed, the error.
+      Failures are reported together in the summary, so that one failed batch doesn't lose the others' conflicts.
+      '''
+      try:
+         return self._resolveBatchOrThrow(batch), None
+      except P4.P4Exception as exception:
+         return [], str(exception)
+
+   def _resolveBatchOrThrow(self, batch):
+      with PerforceWrapper(squelchErrorAndWarninMessages=True, priority=PRIORITY_BACKGROUND) as p4:
+         p4.run_resolve("-am", batch)
+
+         return [
+            {
+               'clientFile': stat['clientFile'],
+               'depotFile': stat['depotFile'],
+               'theirsFile': stat.get('resolveFromFile0'),
+               'theirsRevision': stat.get('resolveEndFromRev0'),
+               'baseFile': stat.get('resolveBaseFile0'),
+               'baseRevision': stat.get('resolveBaseRev0')
+            }
+            for stat in p4.run_fstat("-Or", batch)
+            if 'unresolved' in stat
+         ]
+
+   def _reportConflicts(self, resolveCount, conflicts, failedBatches):
+      failedFileCount = sum(len(batch) for batch, error in failedBatches)
+      message = "Subforce: auto-resolved {} of {} file(s)".format(resolveCount - len(conflicts) - failedFileCount, resolveCount)
+      if failedBatches:
+         message += "; {} batch(es) of {} file(s) failed".format(len(failedBatches), failedFileCount)
+      print(message)
+      self._window.status_message(message)
+
+      if failedBatches:
+         sublime.error_message(
+            "{}:\n\n{}".format(
+               message,
+               "\n\n".join("{}\n\t{}".format(error.strip(), "\n\t".join(batch)) for batch, error in failedBatches)
+            )
+         )
+
+      if not conflicts:
+         return
+
+      def onDone(selectedIndex):
+         if selectedIndex >= 0:
+            self.viewConflict(conflicts[selectedIndex])
+
+      conflictItems = [
+         [
+            conflict['clientFile'],
+            "theirs: {}".format(getRevisionQualifiedDepotPath(conflict['theirsFile'], conflict['theirsRevision']))
+         ]
+         for conflict in conflicts
+      ]
+
+      self._window.show_quick_panel(conflictItems, onDone, sublime.KEEP_OPEN_ON_FOCUS_LOST)
+
+   def viewConflict(self, conflict):
+      def fetchRevisions():
+         with PerforceWrapper() as p4:
+            panes = []
+            if conflict['theirsFile'] and conflict['theirsRevision']:
+               panes.append((
+                  DepotRevisionCache.getTemporaryFile(p4, conflict['theirsFile'], conflict['theirsRevision']),
+                  "Theirs: {}".format(getRevisionQualifiedDepotPath(conflict['theirsFile'], conflict['theirsRevision']))
+               ))
+            if conflict['baseFile'] and conflict['baseRevision']:
+               panes.append((
+                  DepotRevisionCache.getTemporaryFile(p4, conflict['baseFile'], conflict['baseRevision']),
+                  "Base: {}".format(getRevisionQualifiedDepotPath(conflict['baseFile'], conflict['baseRevision']))
+               ))
+            panes.append((conflict['clientFile'], None))
+
+            sublime.set_timeout(lambda: self._showConflictPanes(panes), 0)
+
+      sublime.set_timeout_async(fetchRevisions, 0)
+
+   def _showConflictPanes(self, panes):
+      self._window.run_command("new_window")
+      conflictWindow = sublime.active_window()
+
+      columnWidth = 1.0 / len(panes)
+      conflictWindow.set_layout(
+         {
+            "cols": [index * columnWidth for index in range(len(panes))] + [1.0],
+            "rows": [0.0, 1.0],
+            "cells": [[index, 0, index + 1, 1] for index in range(len(panes))]
+         }
+      )
+
+      for group, (path, depotRevisionLabel) in enumerate(panes):
+         conflictWindow.focus_group(group)
+         view = conflictWindow.open_file(path)
+         if depotRevisionLabel: # depot revisions are for reference only; the workspace file is where the merge happens
+            view.set_read_only(True)
+            view.set_status(CONFLICT_PANE_STATUS_KEY, depotRevisionLabel)
+
+class SubforceAutoResolveCommand(sublime_plugin.WindowCommand):
+   '''
+   Auto-resolves pending files, accepting merged content when there are no conflicts.
+   When no paths are given, all pending files in the workspace are resolved.
+   Files that still conflict may be opened in an in-editor three-way conflict view.
+   '''
+   def run(self, paths=[]):
+      paths = [ellipsizeIfDirectory(path) for path in paths] if paths else ["//..."]
+      ResolveManager(self.window).autoResolve(paths)
+
+class SubforceMarkResolvedCommand(sublime_plugin.WindowCommand):
+   '''
+   Resolves one or more files by accepting the workspace file as-is (i.e. after manually merging conflicts).
+   '''
+   def run(self, paths=[]):
+      with PerforceWrapper() as p4:
+         paths = coercePathsToActiveViewIfNeeded(paths, self.window)
+         paths = [ellipsizeIfDirectory(path) for path in paths]
+
+         print("Subforce: marking resolved\n\t{}".format("\n\t".join(paths)))
+         p4.run_resolve("-ay", paths)
+
+def createGrepOutputHandler(onResult, isCancelled):
+   # Defined on demand, since subclassing P4.OutputHandler at module level would import P4 at plugin load.
+   class GrepOutputHandler(P4.OutputHandler):
+      '''
+      Passes 'p4 grep' results to a callback as the server sends them, instead of collecting them all first.
+      '''
+      def outputStat(self, stat):
+         if isCancelled():
+            return P4.OutputHandler.CANCEL
+
+         onResult(stat)
+         return P4.OutputHandler.HANDLED
+
+   return GrepOutputHandler()
+
+def createGrepKeepAlive(isCancelled, onPoll):
+   # Defined on demand for the same reason as createGrepOutputHandler.
+   class GrepKeepAlive(P4.PyKeepAlive):
+      '''
+      Polled by P4 while a command is running, so that a search can be cancelled (and its results flushed)
+      even while the server is scanning files without sending any results.
+      '''
+      def __init__(self):
+         P4.PyKeepAlive.__init__(self)
+         self.searching = True
+
+      def isAlive(self):
+         # The keep-alive stays attached to the pooled connection, so it must not break later commands.
+         if not self.searching:
+            return 1
+
+         onPoll()
+         return 0 if isCancelled() else 1
+
+   return GrepKeepAlive()
+
+class GrepManager(object):
+   '''
+   Searches depot content with 'p4 grep', streaming results into a results view a page at a time.
+   Paths that exceed the server's grep limits are split into their subdirectories and searched chunk by chunk.
+   '''
+   _activeSearches = {} # results view id -> cancellation event
+   _activeSearchesLock = threading.Lock()
+
+   def __init__(self, window):
+      self._window = window
+      self._settings = SettingsWrapper()
+
+   def grep(self, pattern, depotPath):
+      resultsView = self._createResultsView(pattern, depotPath)
+
+      cancelEvent = threading.Event()
+      with self._activeSearchesLock:
+         self._activeSearches[resultsView.id()] = cancelEvent
+
+      threading.Thread(target=lambda: self._grep(pattern, depotPath, resultsView, cancelEvent)).start()
+
+   @classmethod
+   def cancel(self, resultsView):
+      with self._activeSearchesLock:
+         cancelEvent = self._activeSearches.get(resultsView.id())
+
+      if cancelEvent:
+         cancelEvent.set()
+
+   def _createResultsView(self, pattern, depotPath):
+      resultsView = self._window.new_file()
+      resultsView.set_name("Subforce Grep: {}".format(pattern))
+      resultsView.set_scratch(True)
+      resultsView.settings().set(GREP_RESULTS_SETTING_KEY, True)
+      resultsView.run_command("subforce_append_text", {"text": "Searching {} for \"{}\"\n\n".format(depotPath, pattern)})
+      return resultsView
+
+   def _grep(self, pattern, depotPath, resultsView, cancelEvent):
+      pageSize = self._settings.get(GREP_PAGE_SIZE_SETTINGS_KEY, 100)
+      maxResults = self._settings.get(GREP_MAX_RESULTS_SETTINGS_KEY, 10000)
+
+      page = []
+      lastFlushTime = time.time()
+      resultCount = 0
+      reachedMaxResults = False
+
+      def flushPage():
+         nonlocal lastFlushTime
+         lastFlushTime = time.time()
+         if page:
+            text = "".join(page)
+            del page[:]
+            sublime.set_timeout(lambda: resultsView.run_command("subforce_append_text", {"text": text}), 0)
+
+      def flushPageIfDue():
+         # Sparse results still show up promptly, instead of waiting for a full page.
+         if page and time.time() - lastFlushTime >= GREP_FLUSH_INTERVAL:
+            flushPage()
+
+      def onResult(stat):
+         nonlocal resultCount, reachedMaxResults
+         if 'matchedLine' not in stat:
+            return
+
+         page.append(
+            "{}:{}: {}\n".format(
+               getRevisionQualifiedDepotPath(stat['depotFile'], stat['rev']),
+               stat['line'],
+               stat['matchedLine']
+            )
+         )
+         resultCount += 1
+
+         if resultCount >= maxResults:
+            reachedMaxResults = True
+            cancelEvent.set()
+
+         if len(page) >= pageSize:
+            flushPage()
+         else:
+            flushPageIfDue()
+
+      try:
+         with PerforceWrapper(priority=PRIORITY_BACKGROUND) as p4:
+            keepAlive = createGrepKeepAlive(cancelEvent.is_set, flushPageIfDue)
+            p4.set_break(keepAlive)
+            try:
+               chunks = [depotPath]
+               while chunks and not cancelEvent.is_set():
+                  chunk = chunks.pop(0)
+                  try:
+                     # The handler keyword only applies for the duration of this command.
+                     p4.run_grep("-n", "-s", "-e", pattern, chunk, handler=createGrepOutputHandler(onResult, cancelEvent.is_set))
+                  except P4.P4Exception as exception:
+                     if cancelEvent.is_set(): # the keep-alive broke off the command
+                        break
+                     elif re.search(SERVER_LIMIT_ERROR_RE, str(exception)) and chunk.endswith("..."):
+                        print("Subforce: server limit reached for {}; searching its subdirectories instead".format(chunk))
+                        chunks[0:0] = self._splitDepotPath(p4, chunk)
+                     else:
+                        raise
+            finally:
+               keepAlive.searching = False
+      finally:
+         flushPage()
+
+         with self._activeSearchesLock:
+            self._activeSearches.pop(resultsView.id(), None)
+
+         if reachedMaxResults:
+            summary = "\n{} match(es); stopped at the {} setting.\n".format(resultCount, GREP_MAX_RESULTS_SETTINGS_KEY)
+         elif cancelEvent.is_set():
+            summary = "\n{} match(es); search cancelled.\n".format(resultCount)
+         else:
+            summary = "\n{} match(es).\n".format(resultCount)
+         sublime.set_timeout(lambda: resultsView.run_command("subforce_append_text", {"text": summary}), 0)
+
+   def _splitDepotPath(self, p4, depotPath):
+      parentPath = depotPath[:-len("...")]
+      return [parentPath + "*"] + [directory['dir'] + "/..." for directory in p4.run_dirs(parentPath + "*")]
+
+class SubforceGrepCommand(sublime_plugin.WindowCommand):
+   '''
+   Searches the content of depot files, whether or not they are synced, using 'p4 grep'.
+   Results stream into a results view; press enter on a result to open that revision.
+   '''
+   def run(self, paths=[]):
+      initialDepotPath = ellipsizeIfDirectory(paths[0]) if paths else "//..."
+
+      def onPatternDone(pattern):
+         def onDepotPathDone(depotPath):
+            GrepManager(self.window).grep(pattern, depotPath)
+
+         self.window.show_input_panel("Depot Path", initialDepotPath, onDepotPathDone, None, None)
+
+      self.window.show_input_panel("Search Pattern", "", onPatternDone, None, None)
+
+class SubforceCancelGrepCommand(sublime_plugin.TextCommand):
+   def run(self, edit):
+      GrepManager.cancel(self.view)
+
+   def is_enabled(self):
+      return bool(self.view.settings().get(GREP_RESULTS_SETTING_KEY, False))
+
+class SubforceOpenGrepResultCommand(sublime_plugin.TextCommand):
+   def run(self, edit):
+      line = self.view.substr(self.view.line(self.view.sel()[0].begin()))
+      grepResultMatch = re.match(GREP_RESULT_RE, line)
+      if not grepResultMatch:
+         return
+
+      depotFilePath, revision, lineNumber = grepResultMatch.groups()
+      RevisionManager(self.view.window(), PerforceWrapper()).openDepotRevision(depotFilePath, revision, lineNumber)
+
+   def is_enabled(self):
+      return bool(self.view.settings().get(GREP_RESULTS_SETTING_KEY, False))
+
+class SubforceGrepResultsEventListener(sublime_plugin.EventListener):
+   def on_close(self, view):
+      if view.settings().get(GREP_RESULTS_SETTING_KEY, False):
+         GrepManager.cancel(view)
 
 class SubforceViewGraphicalDiffWorkspaceFileCommand(sublime_plugin.WindowCommand):
    '''
@@ -785,3 +1709,57 @@ class SubforceViewGraphicalDiffDepotRevisionsCommand(sublime_plugin.WindowComman
          revisionManager.showHaveHeadAndFileRevisions(path, onDoneCallback2)
       revisionManager.showHaveHeadAndFileRevisions(path, onDoneCallback1)
 
+class SubforceViewDiffOfDepotRevisionsCommand(sublime_plugin.WindowCommand):
+   '''
+   Diffs two depot revisions of a given file on the server ('p4 diff2') and shows the unified diff in a view.
+   Only a single file may be diffed at a time.
+   '''
+   def run(self, paths=[]):
+      perforceWrapper = PerforceWrapper()
+      revisionManager = RevisionManager(self.window, perforceWrapper)
+
+      paths = coercePathsToActiveViewIfNeeded(paths, self.window)
+
+      path = checkForAndGetSinglePath(paths)
+      if not path:
+         return
+
+      def onDoneCallback1(selectedRevision1):
+         def onDoneCallback2(selectedRevision2):
+            revisionManager.diff2DepotRevisions(selectedRevision1, selectedRevision2, path)
+         revisionManager.showHaveHeadAndFileRevisions(path, onDoneCallback2)
+      revisionManager.showHaveHeadAndFileRevisions(path, onDoneCallback1)
+
+class SubforceNavigateDiffHunkCommand(sublime_plugin.TextCommand):
+   def run(self, edit, forward=True):
+      hunks = self.view.find_all(r'^@@ ')
+      if not hunks:
+         return
+
+      caret = self.view.sel()[0].begin()
+      if forward:
+         nextHunks = [hunk for hunk in hunks if hunk.begin() > caret]
+         hunk = nextHunks[0] if nextHunks else hunks[0]
+      else:
+         previousHunks = [hunk for hunk in hunks if hunk.begin() < caret]
+         hunk = previousHunks[-1] if previousHunks else hunks[-1]
+
+      self.view.sel().clear()
+      self.view.sel().add(sublime.Region(hunk.begin()))
+      self.view.show_at_center(hunk.begin())
+
+   def is_enabled(self):
+      return bool(self.view.settings().get(DIFF2_VIEW_SETTING_KEY, False))
+
+class SubforceOpenDiffInP4MergeCommand(sublime_plugin.TextCommand):
+   '''
+   Opens the revisions of a server-side diff in the P4Merge GUI, downloading their full content.
+   '''
+   def run(self, edit):
+      settings = self.view.settings()
+      revision1, revision2 = settings.get(DIFF2_REVISIONS_SETTING_KEY)
+
+      RevisionManager(self.view.window(), PerforceWrapper()).diffDepotRevisions(revision1, revision2, settings.get(DIFF2_FILE_SETTING_KEY))
+
+   def is_enabled(self):
+      return bool(self.view.settings().get(DIFF2_VIEW_SETTING_KEY, False))
@@ -1,5 +1,6 @@
 import sublime
 import os
+import importlib
 
 def getAllViewsForPath(path):
    return [view for view in (window.find_open_file(path) for window in sublime.windows()) if view is not None]
@@ -20,4 +21,20 @@ def checkForAndGetSinglePath(paths):
 def ellipsizeIfDirectory(path):
    return os.path.join(path, '...') if os.path.isdir(path) else path
 
-createRevision = lambda revision, description: {'revision': revision, 'desc': description}
\ No newline at end of file
+def splitIntoBatches(items, batchSize):
+   return [items[index:index + batchSize] for index in range(0, len(items), max(1, batchSize))]
+
+createRevision = lambda revision, description, change=None: {'revision': revision, 'desc': description, 'change': change}
+
+class LazyModule(object):
+   '''
+   Defers importing a module until one of its attributes is first accessed.
+   '''
+   def __init__(self, name):
+      self._name = name
+      self._module = None
+
+   def __getattr__(self, name):
+      if self._module is None:
+         self._module = importlib.import_module(self._name)
+      return getattr(self._module, name)